@@ -2,16 +2,54 @@
 # Kevin Nikolaus
 # November 21st, 2024
 
+import binascii
+import functools
+import operator
+import os
+import queue
+import selectors
 import serial
-import time
+import threading
 import redis
 
 # Redis connection
 REDIS_HOST = "localhost"
 REDIS_PORT = 6379
 REDIS_DB = 0
+REDIS_SOCKET_PATH = "/var/run/redis/redis.sock"  # Used instead of TCP when present
 
-redis_conn = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB)
+REDIS_QUEUE_SIZE = 256  # Samples buffered for the writer thread before the oldest are dropped
+REDIS_VALUE_FORMAT = b"%.6f"  # Format of the stored values read by consumers
+REDIS_EXIT_TIMEOUT = 2.0  # Seconds to wait for the final write on exit
+
+# Keep a single connection, over the UNIX socket when the server exposes one we can open
+redis_conn = None
+if os.path.exists(REDIS_SOCKET_PATH):
+    redis_pool = redis.BlockingConnectionPool(
+        connection_class=redis.UnixDomainSocketConnection,
+        path=REDIS_SOCKET_PATH,
+        db=REDIS_DB,
+        health_check_interval=0,
+        max_connections=1
+    )
+    redis_conn = redis.Redis(connection_pool=redis_pool)
+    try:
+        redis_conn.ping()  # Open the connection before entering the main loop
+    except redis.ConnectionError as e:
+        print("Redis socket unavailable, falling back to TCP:", e)
+        redis_pool.disconnect()
+        redis_conn = None
+if redis_conn is None:
+    redis_pool = redis.BlockingConnectionPool(
+        host=REDIS_HOST,
+        port=REDIS_PORT,
+        db=REDIS_DB,
+        socket_keepalive=True,
+        health_check_interval=0,
+        max_connections=1
+    )
+    redis_conn = redis.Redis(connection_pool=redis_pool)
+    redis_conn.ping()  # Open the connection before entering the main loop
 
 # Initialize the serial port
 ser = serial.Serial(
@@ -20,33 +58,37 @@ ser = serial.Serial(
     bytesize=serial.EIGHTBITS,
     parity=serial.PARITY_NONE,
     stopbits=serial.STOPBITS_ONE,
-    timeout=1            # Timeout in seconds
+    timeout=0.2          # Timeout in seconds (bounds each blocking read)
 )
 
+# Wait on the port's file descriptor where the platform supports it (not on Windows)
+selector = selectors.DefaultSelector()
+try:
+    selector.register(ser.fileno(), selectors.EVENT_READ)
+except (AttributeError, OSError, ValueError):
+    selector = None
+
 def calculate_bcc(data):
     """Calculate the BCC (Block Check Character) for given data."""
-    bcc = 0
-    for byte in data:
-        bcc ^= byte
-    return bcc
+    return functools.reduce(operator.xor, data, 0)
 
-def validate_and_clean_response(response):
+def validate_response(response, bcc):
     """
-    Validate the response frame and clean extra trailing characters.
+    Validate a response frame read up to and including its ETX.
 
     Parameters:
-        response (str): The raw response frame as a string.
+        response (bytes): The raw response frame, STX through ETX.
+        bcc (bytes): The BCC byte that followed the ETX.
 
     Returns:
-        str: The cleaned response frame.
+        bytes: The validated response frame.
     """
-    if not response or response[0] != '\x02':
+    if not response or response[0] != STX:
         raise ValueError("Missing STX at the beginning of the frame.")
-    if '\x03' not in response:
+    if response[-1] != ETX:
         raise ValueError("Missing ETX in the frame.")
-    
-    # Trim everything after the first ETX
-    response = response[:response.index('\x03') + 1]
+    if not bcc or calculate_bcc(response[1:]) != bcc[0]:
+        raise ValueError("BCC mismatch in the frame.")
     return response
 
 def extract_data_section(response):
@@ -54,95 +96,167 @@ def extract_data_section(response):
     Extract the data section from the response frame based on CompoWay/F structure.
 
     Parameters:
-        response (str): The validated and cleaned response frame as a string.
+        response (bytes): The validated response frame.
 
     Returns:
-        str: The extracted data section.
+        bytes: The extracted data section (ASCII hex digits).
     """
-    # Strip STX and ETX
-    frame_body = response[1:-1]
-
-    # Check minimum length of the response frame
-    if len(frame_body) < 16:
+    # Body header: Node(2) + SubAddress(2) + End Code(2) + MRC(2) + SRC(2) + Response Code(4)
+    if len(response) <= 16:  # STX + 14-byte header + ETX leaves no data
         raise ValueError("Frame too short to extract data")
 
-    # Extract sections based on the structure
-    data_section = frame_body[13:]  # Data Section
-    return data_section
+    # Data section runs from offset 14 of the body (after STX) up to ETX
+    return response[15:-1]
 
 def decode_signed_value(hex_value, bit_length=16):
     """
     Decode a hexadecimal value as a signed integer based on two's complement.
 
     Parameters:
-        hex_value (str): The hexadecimal string representation of the value.
+        hex_value (bytes): The ASCII hexadecimal representation of the value,
+            exactly bit_length // 4 digits long.
         bit_length (int): The bit length of the value (default is 16).
 
     Returns:
         int: The decoded signed integer value.
     """
-    value = int(hex_value, 16)  # Convert hex to integer
-    # Check if the value is negative in two's complement
-    if value >= 2**(bit_length - 1):  # MSB is set
-        value -= 2**bit_length
-    return value
+    if len(hex_value) != bit_length // 4:
+        raise ValueError("Expected {} hex digits, got {}".format(bit_length // 4, len(hex_value)))
+    return int.from_bytes(binascii.unhexlify(hex_value), 'big', signed=True)
 
 # Frame components
 STX = 0x02  # Start of Text
 ETX = 0x03  # End of Text
+ETX_BYTES = bytes([ETX])  # ETX as a read_until terminator
 Node = "01"  # Node Number
 SubAddress = "00"  # Sub-address (not used, set to "00")
 ServiceID = "0"  # Service ID (not used, set to "0")
 MRC = "01"  # Main Request Code
 SRC = "01"  # Sub Request Code
 Variable_Type = "C0"  # Variable Type
-Address = "0002"  # Monitor values
 Bit_Position = "00"  # Always 00 for K3HB
 Number_of_Elements = "0001"  # Read one element
-CommandText = Variable_Type + Address + Bit_Position + Number_of_Elements
-data_ascii = Node + SubAddress + ServiceID + MRC + SRC + CommandText
 
-# Main program loop
-try:
+# Registers to poll each cycle, as (Address, Redis key)
+REGISTERS = (
+    ("0002", "load-cell"),  # Monitor values
+)
+
+def build_frame(address):
+    """
+    Build the CompoWay/F request frame that reads one element at an address.
+
+    Parameters:
+        address (str): The four-digit variable address.
+
+    Returns:
+        bytes: The complete frame, STX through BCC.
+    """
+    CommandText = Variable_Type + address + Bit_Position + Number_of_Elements
+    data_ascii = Node + SubAddress + ServiceID + MRC + SRC + CommandText
+    body = data_ascii.encode('ascii') + bytes([ETX])
+    return bytes([STX]) + body + bytes([calculate_bcc(body)])  # BCC excludes STX
+
+# The requests never change, so build them once
+REQUESTS = tuple((build_frame(address), key) for address, key in REGISTERS)
+
+# Hand samples to a background thread so Redis I/O never stalls the serial loop
+sample_queue = queue.Queue(maxsize=REDIS_QUEUE_SIZE)
+STOP_WRITER = object()  # Queued on exit so the writer flushes and returns
+
+def redis_writer():
+    """Drain queued samples into Redis, writing only the latest value per key."""
+    stopping = False
+    while not stopping:
+        sample = sample_queue.get()
+        latest = {}
+        while True:
+            if sample is STOP_WRITER:
+                stopping = True
+            else:
+                key, value = sample
+                latest[key] = value
+            try:
+                sample = sample_queue.get_nowait()
+            except queue.Empty:
+                break
+        if not latest:
+            continue
+        latest = {key: REDIS_VALUE_FORMAT % value for key, value in latest.items()}
+        # Readers only see the current value, so older samples would be overwritten anyway
+        try:
+            redis_conn.mset(latest)
+        except redis.RedisError as e:
+            print("Error writing to Redis:", e)
+
+def queue_sample(sample):
+    """Queue a (key, value) sample for Redis, dropping the oldest one if the writer is behind."""
     while True:
-        if ser.in_waiting == 0:  # Check if there's no incoming data
-            # Construct the frame
-            frame = bytearray()
-            frame.append(STX)
-            frame.extend(data_ascii.encode('ascii'))  # Add ASCII data
-            frame.append(ETX)
-
-            # Calculate and append the BCC
-            bcc = calculate_bcc(frame[1:])  # Calculate BCC (excluding STX)
-            frame.append(bcc)
-
-            # Send the frame
-            ser.write(frame)
-
-            # Wait for a response
-            time.sleep(0.1)
-        else:
-            raw_response = ser.read(ser.in_waiting).decode('ascii', errors='ignore')
+        try:
+            sample_queue.put_nowait(sample)
+            return
+        except queue.Full:
             try:
-                # Step 1: Validate and clean the response
-                cleaned_response = validate_and_clean_response(raw_response)
+                sample_queue.get_nowait()
+            except queue.Empty:
+                pass
+
+redis_writer_thread = threading.Thread(target=redis_writer, daemon=True)
+redis_writer_thread.start()
 
-                # Step 2: Extract the data section
-                data_section = extract_data_section(cleaned_response)
+def main():
+    """Poll the indicator forever, handing decoded values to the Redis writer."""
+    # Bind the methods used every iteration as locals to skip repeated attribute lookups
+    serial_reset_input = ser.reset_input_buffer
+    serial_write = ser.write
+    serial_read = ser.read
+    serial_read_until = ser.read_until
+    wait_readable = selector.select if selector is not None else None
+    read_timeout = ser.timeout
 
-                # Step 3: Decode the signed value
-                decoded_value = decode_signed_value(data_section)  # Decode the signed integer
-                display_value = decoded_value / 10  # Scale the value as per the decimal place
+    try:
+        while True:
+            # CompoWay/F is half-duplex: finish each transaction before sending the next
+            for frame, key in REQUESTS:
+                # Discard anything left over from a failed transaction so replies can't shift keys
+                serial_reset_input()
+
+                # Send the frame and block until the response arrives (or times out)
+                serial_write(frame)
+                if wait_readable is not None and not wait_readable(timeout=read_timeout):
+                    print("Timed out waiting for a response.")
+                    continue
+                raw_response = serial_read_until(expected=ETX_BYTES, size=128)
+                if not raw_response:
+                    print("Timed out waiting for a response.")
+                    continue
+                bcc = serial_read(1)  # Trailing BCC byte
+                try:
+                    # Step 1: Validate the response
+                    response = validate_response(raw_response, bcc)
+
+                    # Step 2: Extract the data section
+                    data_section = extract_data_section(response)
+
+                    # Step 3: Decode the signed value (C0 variables are 32-bit)
+                    decoded_value = decode_signed_value(data_section, bit_length=32)  # Decode the signed integer
+                    display_value = decoded_value / 10  # Scale the value as per the decimal place
                 
-                # Step 4: Store in Redis
-                redis_conn.set("load-cell", "{:.6f}".format(display_value))
-                print("DISPLAY:", display_value)
+                    # Step 4: Hand off to the Redis writer
+                    queue_sample((key, display_value))
+                    print("DISPLAY:", display_value)
                 
-            except ValueError as e:
-                print("Error decoding response:", e)
-            time.sleep(0.1)
-
-except KeyboardInterrupt:
-    print("Exiting...")
-finally:
-    ser.close()
+                except ValueError as e:
+                    print("Error decoding response:", e)
+
+    except KeyboardInterrupt:
+        print("Exiting...")
+    finally:
+        ser.close()
+        # Let the writer store the last samples before the process exits
+        queue_sample(STOP_WRITER)
+        redis_writer_thread.join(timeout=REDIS_EXIT_TIMEOUT)
+
+# Main program loop
+if __name__ == "__main__":
+    main()
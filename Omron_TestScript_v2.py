@@ -8,8 +8,10 @@
 # https://assets.omron.eu/downloads/latest/manual/en/n128_k3hb-s_-x_-v_-h_digital_indicators_users_manual_en.pdf?v=7
 # https://assets.omron.eu/downloads/latest/manual/en/n129_k3hb_communications_manual_en.pdf?v=5
 
+import functools
+import operator
+import selectors
 import serial
-import time
 
 # Initialize the serial port
 ser = serial.Serial(
@@ -21,12 +23,16 @@ ser = serial.Serial(
     timeout=1            # Timeout in seconds
 )
 
+# Wait on the port's file descriptor where the platform supports it (not on Windows)
+selector = selectors.DefaultSelector()
+try:
+    selector.register(ser.fileno(), selectors.EVENT_READ)
+except (AttributeError, OSError, ValueError):
+    selector = None
+
 def calculate_bcc(data):
     """Calculate the BCC (Block Check Character) for given data."""
-    bcc = 0
-    for byte in data:
-        bcc ^= byte
-    return bcc
+    return functools.reduce(operator.xor, data, 0)
 
 def validate_and_clean_response(response):
     """
@@ -86,41 +92,43 @@ data_ascii = Node + SubAddress + ServiceID + MRC + SRC + CommandText
 # Main program loop
 try:
     while True:
-        if ser.in_waiting == 0:  # Check if there's no incoming data
-            # Construct the frame
-            frame = bytearray()
-            frame.append(STX)
-            frame.extend(data_ascii.encode('ascii'))  # Add ASCII data
-            frame.append(ETX)
-
-            # Calculate and append the BCC
-            bcc = calculate_bcc(frame[1:])  # Calculate BCC (excluding STX)
-            frame.append(bcc)
-
-            # Send the frame
-            ser.write(frame)
-            #print("Sent frame (hex):", frame.hex())
-            #print("Sent frame (ASCII):", frame.decode('ascii', errors='ignore'))
-
-            # Wait for a response
-            time.sleep(.1)
-        else:
-            raw_response = ser.read(ser.in_waiting).decode('ascii', errors='ignore')
-            #print("Raw Response:", raw_response)
-            try:
-                # Step 1: Validate and clean the response
-                cleaned_response = validate_and_clean_response(raw_response)
-                #print("Cleaned Response:", cleaned_response)
-
-                # Step 2: Extract the data section
-                data_section = extract_data_section(cleaned_response)
-                display_value = int(data_section, 16) / 10  # Assuming the decimal point is implied at one decimal place
-                #print("Extracted Data Section:", data_section)
-                print("DISPLAY:", display_value) 
-                
-            except ValueError as e:
-                print("Error decoding response:", e)
-            time.sleep(.1)
+        # Construct the frame
+        frame = bytearray()
+        frame.append(STX)
+        frame.extend(data_ascii.encode('ascii'))  # Add ASCII data
+        frame.append(ETX)
+
+        # Calculate and append the BCC
+        bcc = calculate_bcc(frame[1:])  # Calculate BCC (excluding STX)
+        frame.append(bcc)
+
+        # Send the frame
+        ser.write(frame)
+        #print("Sent frame (hex):", frame.hex())
+        #print("Sent frame (ASCII):", frame.decode('ascii', errors='ignore'))
+
+        # Wait for a response
+        if selector is not None and not selector.select(timeout=ser.timeout):
+            print("Timed out waiting for a response.")
+            continue
+
+        # Read one whole frame; select() wakes on the first byte, not the last
+        raw_response = ser.read_until(bytes([ETX])).decode('ascii', errors='ignore')
+        ser.read(1)  # Trailing BCC byte
+        #print("Raw Response:", raw_response)
+        try:
+            # Step 1: Validate and clean the response
+            cleaned_response = validate_and_clean_response(raw_response)
+            #print("Cleaned Response:", cleaned_response)
+
+            # Step 2: Extract the data section
+            data_section = extract_data_section(cleaned_response)
+            display_value = int(data_section, 16) / 10  # Assuming the decimal point is implied at one decimal place
+            #print("Extracted Data Section:", data_section)
+            print("DISPLAY:", display_value) 
+            
+        except ValueError as e:
+            print("Error decoding response:", e)
 
 except KeyboardInterrupt:
     print("Exiting...")